@@ -63,10 +63,8 @@ class calibrate(object):
         else:
             lp, imp = points
             
-        z_lst = []        
-        for x in lp:
-            z_lst.append(self.camera.projection(x, correction=correction))
-        e = array(z_lst) - array(imp)
+        z_lst = self.camera.projection_batch(lp, correction=correction)
+        e = z_lst - array(imp)
         D = mean( sum(e**2, axis=1)**0.5 )
         
         return D
@@ -387,7 +385,7 @@ class calibrate(object):
         for i in range(imc.shape[0]):
             ax.text(imc[i,0], imc[i,1], '%d'%i, color = 'b')
         
-        z_lst = array([self.camera.projection(x) for x in self.lab_coords])
+        z_lst = self.camera.projection_batch(self.lab_coords)
         ax.plot( z_lst[:,0], z_lst[:,1], 'xr' )
         for i in range(z_lst.shape[0]):
             ax.text(z_lst[i,0], z_lst[i,1], '%d'%i, color = 'r')
@@ -402,7 +400,7 @@ class calibrate(object):
             fig, ax = plt.subplots()
         
         imc = array(self.img_coords)
-        z_lst = array([self.camera.projection(x) for x in self.lab_coords])
+        z_lst = self.camera.projection_batch(self.lab_coords)
         err = sum((imc-z_lst)**2, axis=1)**0.5
         
         h = ax.hist( err, bins='auto')
@@ -450,6 +448,7 @@ class calibrate(object):
                     self.camera.O[2] += increment
                 if cmd == 'c':
                     self.camera.theta[2] += increment
+                self.camera.calc_R()
                 
                 D = self.mean_squared_err()
                 self.D_lst.append( D )
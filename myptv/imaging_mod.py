@@ -43,9 +43,104 @@ of 27 coefficients.
 
 import os
 from math import sin, cos
-from numpy import zeros, array, dot
-from numpy.linalg import inv
-from myptv.utils import line_dist
+from numpy import zeros, empty, array, dot, stack, einsum, triu_indices
+from numpy import errstate, bitwise_or, ascontiguousarray, asarray, column_stack
+from numpy import cross, float64, where
+from numpy.linalg import norm, LinAlgError
+from myptv.utils import nearest_point_to_lines
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+try:
+    import numexpr
+except ImportError:
+    numexpr = None
+
+
+
+
+def stereo_match_kernel(O, r, d_max):
+    '''
+    Finds the crossing points of all the pairs of lines (O[i] + a r[i]), 
+    and averages those that cross at distances smaller than d_max. This 
+    is written as explicit scalar loops, which for the few lines of a 
+    single particle is faster than numpy, and is compiled with numba if it
+    is installed.
+    
+    input - 
+    O, r (N X 3) - the origins and directions of N lines. When numba is
+                   installed the kernel is compiled for C-contiguous 
+                   float64 arrays only, and other inputs (e.g. float32 or
+                   sliced arrays) raise a TypeError; pass them through 
+                   ascontiguousarray(..., dtype=float64) first. Without 
+                   numba these are best given as nested lists of floats.
+    d_max (float) - maximum allowable distance separating two lines
+    
+    output - 
+    x (array, 3) - the average crossing point of the accepted pairs
+    dist (float) - the average distance between the accepted pairs
+    cams_mask (int) - a bit mask of the lines that belong to accepted 
+                      pairs; bit i is set if line i is used, so 0 means 
+                      that no pair was accepted
+    '''
+    N = len(O)
+    cams_mask = 0
+    x0, x1, x2 = 0.0, 0.0, 0.0
+    dist = 0.0
+    n = 0
+    for i in range(N):
+        Oi0, Oi1, Oi2 = O[i][0], O[i][1], O[i][2]
+        ri0, ri1, ri2 = r[i][0], r[i][1], r[i][2]
+        for j in range(i+1, N):
+            Oj0, Oj1, Oj2 = O[j][0], O[j][1], O[j][2]
+            rj0, rj1, rj2 = r[j][0], r[j][1], r[j][2]
+            
+            r1r2 = ri0*rj0 + ri1*rj1 + ri2*rj2
+            r12 = ri0**2 + ri1**2 + ri2**2
+            r22 = rj0**2 + rj1**2 + rj2**2
+            det = r1r2**2 - r12 * r22
+            
+            # parallel lines are rejected
+            if det == 0.0:
+                continue
+            
+            d0, d1, d2 = Oj0 - Oi0, Oj1 - Oi1, Oj2 - Oi2
+            B0 = ri0*d0 + ri1*d1 + ri2*d2
+            B1 = rj0*d0 + rj1*d1 + rj2*d2
+            a = (-r22*B0 + r1r2*B1) / det
+            b = (-r1r2*B0 + r12*B1) / det
+            
+            l10, l11, l12 = Oi0 + a*ri0, Oi1 + a*ri1, Oi2 + a*ri2
+            l20, l21, l22 = Oj0 + b*rj0, Oj1 + b*rj1, Oj2 + b*rj2
+            D = ((l10-l20)**2 + (l11-l21)**2 + (l12-l22)**2)**0.5
+            
+            if D <= d_max:
+                cams_mask |= (1 << i) | (1 << j)
+                x0 += (l10 + l20) * 0.5
+                x1 += (l11 + l21) * 0.5
+                x2 += (l12 + l22) * 0.5
+                dist += D
+                n += 1
+    
+    x = zeros(3)
+    if n > 0:
+        x[0], x[1], x[2] = x0/n, x1/n, x2/n
+        dist = dist/n
+    return x, dist, cams_mask
+
+
+if njit is not None:
+    # compiled eagerly for C-contiguous float64 arrays, so the compiler 
+    # knows the rows are unit-stride and the compilation happens once at 
+    # import (and is then cached on disk) rather than on the first match
+    stereo_match_kernel = njit('Tuple((float64[::1], float64, int64))'
+                               '(float64[:,::1], float64[:,::1], float64)',
+                               cache=True, fastmath=True)(stereo_match_kernel)
+    
+
 
 
 
@@ -56,8 +151,69 @@ class img_system(object):
     an object that holds a number of cameras.
     '''
     
-    def __init__(self, camera_list):
+    def __init__(self, camera_list, dtype=float64):
+        '''
+        input - 
+        camera_list - a list of camera objects
+        dtype - the floating point precision used in stereo_match_batch.
+                With many particles float32 makes the batch matching 
+                cheaper, at the price of accuracy. stereo_match, which 
+                handles one particle, and the calibration always use 
+                float64.
+        '''
         self.cameras = camera_list
+        self.dtype = dtype
+        self._stacks_version = None
+    
+    
+    def _rebuild_stacks(self):
+        '''
+        Stacks the cameras' O, R and f into contiguous arrays, O_stack (M,3),
+        R_stack (M,3,3) and f_stack (M), so that all the cameras can be 
+        handled at once. O_stack_dtype is a copy of O_stack in the precision
+        used for batch stereo matching. The stacks are rebuilt only if calc_R was 
+        called for one of the cameras, or if one of their O or f values 
+        changed, since they were last built.
+        '''
+        version = tuple([(cam.R_version, cam.f) + tuple(cam.O) 
+                         for cam in self.cameras])
+        if version == self._stacks_version:
+            return
+        
+        self.O_stack = ascontiguousarray([cam.O for cam in self.cameras],
+                                         dtype=float)
+        self.R_stack = ascontiguousarray([cam.R for cam in self.cameras],
+                                         dtype=float)
+        self.f_stack = ascontiguousarray([cam.f for cam in self.cameras],
+                                         dtype=float)
+        self.O_stack_dtype = self.O_stack.astype(self.dtype)
+        self._stacks_version = version
+    
+    
+    def project_all(self, x, correction=True):
+        '''
+        will return the image coordinates (eta, zeta) of a real point x in 
+        all of the cameras.
+        
+        input - x (array,3) - real world coordinates
+                correction - if True, will return the coordinates after
+                the non-linear error correction. If False, we not do the
+                correction.
+        output - (array, M X 2) - the camera coordinates of the projections
+                                  of x, ordered as in self.cameras
+        '''
+        self._rebuild_stacks()
+        v = einsum('mij,mj->mi', self.R_stack, x - self.O_stack)
+        a = v[:,2] / self.f_stack
+        
+        res = zeros((len(self.cameras), 2))
+        for m, cam in enumerate(self.cameras):
+            eta_ = v[m,0] / a[m] + cam.cx + cam.xh
+            zeta_ = v[m,1] / a[m] + cam.cy + cam.yh
+            if correction:
+                eta_, zeta_ = cam.eta_zeta_from_bRinv(eta_, zeta_)
+            res[m,0], res[m,1] = eta_, zeta_
+        return res
     
     
     def stereo_match(self, coords, d_max):
@@ -84,32 +240,178 @@ class img_system(object):
         None
         '''
         N = len(coords)
-        x = []
-        cams = []
-        d = []
+        if N < 2:
+            return None
+        
+        # for a single particle gathering the few camera origins directly 
+        # is cheaper than checking whether the stacks are up to date
         keys = list(coords.keys())
-        for i in range(N):
-            for j in range(i+1,N):
-                ki = keys[i]
-                O1 = self.cameras[ki].O
-                r1 = self.cameras[ki].get_r(coords[ki][0], coords[ki][1])
-                
-                kj = keys[j]
-                O2 = self.cameras[kj].O
-                r2 = self.cameras[kj].get_r(coords[kj][0], coords[kj][1])
-                
-                D, x_ij = line_dist(O1, r1, O2, r2)
-                
-                if D <= d_max:
-                    x.append(x_ij)
-                    cams.append(ki)
-                    cams.append(kj)
-                    d.append(D)
-
-        if len(x)>=1:
-            return sum(x)/1.0/len(x), set(cams), sum(d)/1.0/len(x)
-        else:
+        O = array([self.cameras[k].O for k in keys], dtype=float64)
+        r = stack([self.cameras[k].get_r(coords[k][0], coords[k][1]) 
+                   for k in keys])
+        
+        # with a few cameras a scalar loop over the pairs is faster than 
+        # numpy operations on tiny arrays, even without numba
+        if njit is None:
+            O, r = O.tolist(), r.tolist()
+        x, dist, cams_mask = stereo_match_kernel(O, r, float(d_max))
+        
+        if cams_mask == 0:
+            return None
+        
+        cams = {keys[b] for b in range(N) if cams_mask >> b & 1}
+        return x, cams, dist
+    
+    
+    def triangulate(self, coords, d_max):
+        '''
+        An alternative to stereo_match that estimates the particle position
+        as the point nearest to all the epipolar lines, solving a single 
+        3X3 linear system instead of averaging the crossing points of 
+        pairs of lines. While some lines pass farther than d_max from this
+        point, the farthest one is rejected and the point is recalculated 
+        with the rest.
+        
+        Note that here the distances are measured between the point and 
+        each line, so d_max and dist do not have the same values as in 
+        stereo_match (where they are the distances between pairs of lines).
+        
+        input - 
+        coords (dic) - keys are camera number, values are the image space 
+                       coordinates of each point. Must have at least 2 entries
+        d_max (float) - maximum allowable distance between the point and 
+                        each line
+        
+        output - either -
+        X (numpy array, 3) - lab space coordinates of the sought point 
+        cams (set) - the camera indexes of the lines that were used
+        dist - average distance of the used lines from X
+        
+        or - (if less than 2 lines were accepted)
+        None
+        '''
+        if len(coords) < 2:
             return None
+        
+        keys = list(coords.keys())
+        O = array([self.cameras[k].O for k in keys], dtype=float64)
+        r = stack([self.cameras[k].get_r(coords[k][0], coords[k][1]) 
+                   for k in keys])
+        
+        # an outlier line pulls the point away from all the other lines, 
+        # so the lines are rejected one at a time, the farthest first
+        used = list(range(len(keys)))
+        while True:
+            try:
+                x, dist = nearest_point_to_lines(O[used], r[used])
+            except LinAlgError:
+                return None    # the remaining lines are parallel
+            
+            if dist.max() <= d_max:
+                break
+            if len(used) == 2:
+                return None
+            used.pop(dist.argmax())
+        
+        cams = set([keys[i] for i in used])
+        return x, cams, dist.mean()
+    
+    
+    def stereo_match_batch(self, coords, d_max):
+        '''
+        Stereo matching of many particles at once, each seen by all the 
+        cameras. This does the same as stereo_match for every particle, 
+        with the computation vectorized over particles and camera pairs.
+        
+        input - 
+        coords (array, N X M X 2) - the image space coordinates of N 
+                       particles in each of the M cameras, ordered as in 
+                       self.cameras. Images that are missing in a camera
+                       can be given as nan, and lines that pass through 
+                       them are rejected.
+        d_max (float) - maximum allowable distance separating two lines
+        
+        output - 
+        X (array, N X 3) - lab space coordinates of the sought points; nan
+                           for particles where no pair of lines was accepted
+        dist (array, N) - average distances to the crossing points
+        cams_mask (array of ints, N) - bit masks of the cameras used for 
+                           each particle; bit i is set if camera i is used
+        '''
+        coords = asarray(coords, dtype=float)
+        M = len(self.cameras)
+        if coords.ndim != 3 or coords.shape[1:] != (M, 2):
+            raise ValueError('coords must have the shape (N, %d, 2)'%M)
+        if M < 2:
+            raise ValueError('stereo matching requires at least 2 cameras')
+        
+        self._rebuild_stacks()
+        r = stack([cam.get_r_batch(coords[:,m,0], coords[:,m,1]) 
+                   for m, cam in enumerate(self.cameras)], axis=1)
+        r = r.astype(self.dtype)
+        
+        # shapes: O1, O2 are (P,3) and r1, r2 are (N,P,3) for P pairs
+        ii, jj = triu_indices(M, 1)
+        O1, O2 = self.O_stack_dtype[ii], self.O_stack_dtype[jj]
+        r1, r2 = r[:,ii], r[:,jj]
+        
+        r1r2 = einsum('npk,npk->np', r1, r2)
+        r12 = einsum('npk,npk->np', r1, r1)
+        r22 = einsum('npk,npk->np', r2, r2)
+        dO = O2 - O1
+        B0 = einsum('npk,pk->np', r1, dO)
+        B1 = einsum('npk,pk->np', r2, dO)
+        c = cross(r1, r2)
+        det = -einsum('npk,npk->np', c, c)
+        
+        # the distance between the lines is |dO . c| / |c|, and the crossing
+        # point is the middle of (O1 + a r1) and (O2 + b r2). numexpr is 
+        # slower than numpy on a single core, so these are evaluated as
+        # fused numexpr expressions only when it can use several threads
+        use_numexpr = numexpr is not None and numexpr.get_num_threads() > 1
+        if use_numexpr:
+            D = numexpr.evaluate('abs(d0*c0 + d1*c1 + d2*c2) / sqrt(-det)',
+                                 local_dict={'d0': dO[:,0], 'd1': dO[:,1],
+                                             'd2': dO[:,2], 'c0': c[:,:,0],
+                                             'c1': c[:,:,1], 'c2': c[:,:,2],
+                                             'det': det})
+            terms = {'r1r2': r1r2, 'r12': r12, 'r22': r22, 
+                     'B0': B0, 'B1': B1, 'det': det}
+            a = numexpr.evaluate('(-r22*B0 + r1r2*B1) / det', 
+                                 local_dict=terms)
+            b = numexpr.evaluate('(-r1r2*B0 + r12*B1) / det', 
+                                 local_dict=terms)
+        else:
+            with errstate(divide='ignore', invalid='ignore'):
+                D = abs(einsum('npk,pk->np', c, dO)) / (-det)**0.5
+                a = (-r22*B0 + r1r2*B1) / det
+                b = (-r1r2*B0 + r12*B1) / det
+        
+        # nan distances (parallel lines or missing images) are rejected
+        accepted = D <= d_max
+        n = accepted.sum(axis=1)
+        
+        x = empty((coords.shape[0], 3))
+        for k in range(3):
+            O1k, O2k, r1k, r2k = O1[:,k], O2[:,k], r1[:,:,k], r2[:,:,k]
+            if use_numexpr:
+                xk = numexpr.evaluate('where(accepted, '
+                                      'O1k + a*r1k + O2k + b*r2k, 0)',
+                                      local_dict={'accepted': accepted,
+                                                  'O1k': O1k, 'O2k': O2k,
+                                                  'r1k': r1k, 'r2k': r2k,
+                                                  'a': a, 'b': b})
+            else:
+                xk = where(accepted, O1k + a*r1k + O2k + b*r2k, 0)
+            x[:,k] = xk.sum(axis=1) * 0.5
+        
+        with errstate(divide='ignore', invalid='ignore'):
+            x = x / n[:,None]
+            dist = where(accepted, D, 0).sum(axis=1) / n
+        
+        pair_bits = (1 << ii) | (1 << jj)
+        cams_mask = bitwise_or.reduce(where(accepted, pair_bits, 0), axis=1)
+        return x.astype(float64), dist.astype(float64), cams_mask
 
 
 
@@ -135,6 +437,8 @@ class camera(object):
         self.f = 1.0               # focal depth / magnification
         self.xh = 0.0              # image center correction, x
         self.yh = 0.0              # image center correction, y
+        self.R = zeros((3,3))      # rotation matrix
+        self.R_version = 0         # counts the calls to calc_R
         self.calc_R()
         self.resolution = resolution
         self.give_name(name)
@@ -160,6 +464,21 @@ class camera(object):
     
     
     
+    @property
+    def resolution(self):
+        return self._resolution
+    
+    @resolution.setter
+    def resolution(self, resolution):
+        '''
+        sets the camera resolution, and the image center (cx, cy) used in 
+        get_r and projection
+        '''
+        self._resolution = resolution
+        self.cx = resolution[0] * 0.5
+        self.cy = resolution[1] * 0.5
+    
+    
     def give_name(self, name):
         '''
         adds a name for the camera
@@ -172,19 +491,32 @@ class camera(object):
     
     def calc_R(self):
         '''
-        calculates the rotation matrix for the camera's angles
+        calculates the rotation matrix for the camera's angles. 
+        
+        The rotation matrix is cached in self.R and is not recalculated 
+        when used, so this must be called every time that theta is changed.
         '''
         tx,ty,tz = self.theta
-        Rx = array([[1,0,0],
-                    [0,cos(tx),-sin(tx)],
-                    [0,sin(tx),cos(tx)]])
-        Ry = array([[cos(ty),0,sin(ty)],
-                     [0,1,0],
-                     [-sin(ty),0,cos(ty)]])
-        Rz = array([[cos(tz),-sin(tz),0],
-                    [sin(tz),cos(tz),0],
-                    [0,0,1]])
-        self.R = dot(dot(Rx,Ry), Rz)
+        ctx, stx = cos(tx), sin(tx)
+        cty, sty = cos(ty), sin(ty)
+        ctz, stz = cos(tz), sin(tz)
+        
+        # R = Rx * Ry * Rz, written out explicitly
+        R = self.R
+        R[0,0] = cty*ctz
+        R[0,1] = -cty*stz
+        R[0,2] = sty
+        R[1,0] = stx*sty*ctz + ctx*stz
+        R[1,1] = ctx*ctz - stx*sty*stz
+        R[1,2] = -stx*cty
+        R[2,0] = stx*stz - ctx*sty*ctz
+        R[2,1] = ctx*sty*stz + stx*ctz
+        R[2,2] = ctx*cty
+        
+        # R is orthogonal, so its inverse is just the transpose
+        self.R_T = self.R.T
+        self._R_list = R.tolist()
+        self.R_version += 1
         
         #bR_inv = dot(-self.O, self.R.T)
         #self.a = bR_inv[2] / self.f
@@ -197,23 +529,52 @@ class camera(object):
         input - pixel coordinates (eta, zeta) seen by the camera
         output - direction vector in real space
         '''
-        # self.calc_R()
-        eta_ = eta - self.resolution[0]/2.0 - self.xh
-        zeta_ = zeta - self.resolution[1]/2.0  - self.yh
+        eta_ = eta - self.cx - self.xh
+        zeta_ = zeta - self.cy  - self.yh
         
         
-        Z3 = [eta, zeta, eta**2, zeta**2, eta * zeta]
+        # Z3 = [eta, zeta, eta**2, zeta**2, eta * zeta]
         #Z3 = [eta, zeta, eta**2, zeta**2, eta * zeta, 
         #      eta**3, eta**2*zeta, eta*zeta**2, zeta**3]
+        e2, z2, ez = eta**2, zeta**2, eta * zeta
+        
+        # the products with E and R are written out with python floats, 
+        # which is much faster than numpy for such small arrays
+        E0, E1, E2 = self.E.tolist()
+        v0 = -eta_ - (E0[0]*eta + E0[1]*zeta + E0[2]*e2 + E0[3]*z2 + E0[4]*ez)
+        v1 = -zeta_ - (E1[0]*eta + E1[1]*zeta + E1[2]*e2 + E1[3]*z2 + E1[4]*ez)
+        v2 = -self.f - (E2[0]*eta + E2[1]*zeta + E2[2]*e2 + E2[3]*z2 + E2[4]*ez)
+        
+        R0, R1, R2 = self._R_list
+        r0 = v0*R0[0] + v1*R1[0] + v2*R2[0]
+        r1 = v0*R0[1] + v1*R1[1] + v2*R2[1]
+        r2 = v0*R0[2] + v1*R1[2] + v2*R2[2]
+        
+        n = (r0**2 + r1**2 + r2**2)**0.5
+        return array([r0/n, r1/n, r2/n])
+    
+    
+    def get_r_batch(self, etas, zetas):
+        '''
+        Same as get_r, but for many image points at once.
+        
+        input - etas, zetas (arrays, N) - pixel coordinates seen by the camera
+        output - (array, N X 3) - direction vectors in real space
+        '''
+        etas = asarray(etas, dtype=float)
+        zetas = asarray(zetas, dtype=float)
+        eta_ = etas - self.cx - self.xh
+        zeta_ = zetas - self.cy  - self.yh
         
+        Z3 = stack([etas, zetas, etas**2, zetas**2, etas * zetas])
         e = dot(self.E, Z3)
         
-        r = dot(array([-eta_, -zeta_, -self.f]) - e, self.R)
-        r = r / (r[0]**2 + r[1]**2 + r[2]**2)**0.5
-        return r
+        v = stack([-eta_ - e[0], -zeta_ - e[1], -self.f - e[2]], axis=1)
+        r = dot(v, self.R)
+        return r / norm(r, axis=1)[:,None]
     
     
-    def projection(self, x, correction=True):
+    def projection(self, x, correction=True, out=None):
         '''
         will return the image coordinate (eta, zeta) of a real point x.
         
@@ -221,23 +582,54 @@ class camera(object):
                 correction - if True, will return the coordinates after
                 the non-linear error correction. If False, we not do the
                 correction.
+                out - optional array of length 2 into which the result 
+                is written
         output - (eta, zeta) (array,2) - camera coordinates of the projection 
                                          of x
         '''
-        b = x - self.O
-        v = dot(b, self.R.T) #inv(self.R))
-        a =  v[2] / self.f
-        eta_ = v[0] / a  + self.resolution[0]/2 + self.xh
-        zeta_ = v[1] / a + self.resolution[1]/2 + self.yh
+        # v = (x - O) * [R]^-1, written out with python floats
+        O0, O1, O2 = self.O
+        dx, dy, dz = float(x[0] - O0), float(x[1] - O1), float(x[2] - O2)
+        R0, R1, R2 = self._R_list
+        v0 = R0[0]*dx + R0[1]*dy + R0[2]*dz
+        v1 = R1[0]*dx + R1[1]*dy + R1[2]*dz
+        v2 = R2[0]*dx + R2[1]*dy + R2[2]*dz
+        
+        a_inv = self.f / v2
+        eta_ = v0 * a_inv + self.cx + self.xh
+        zeta_ = v1 * a_inv + self.cy + self.yh
         
         # if we add the error correction term.
         if correction:
-            eta, zeta = self.eta_zeta_from_bRinv(eta_, zeta_)
-            return array([eta, zeta])
+            eta_, zeta_ = self.eta_zeta_from_bRinv(eta_, zeta_)
         
-        # if we don't use the error correction term.
-        else:
-            return array([eta_, zeta_])
+        if out is None:
+            out = empty(2)
+        out[0] = eta_
+        out[1] = zeta_
+        return out
+    
+    
+    def projection_batch(self, X, correction=True):
+        '''
+        Same as projection, but for many real points at once.
+        
+        input - X (array, N X 3) - real world coordinates
+                correction - if True, will return the coordinates after
+                the non-linear error correction. If False, we not do the
+                correction.
+        output - (array, N X 2) - camera coordinates of the projections 
+                                  of the points in X
+        '''
+        v = dot(asarray(X, dtype=float) - self.O, self.R_T)
+        a = v[:,2] / self.f
+        eta_ = v[:,0] / a  + self.cx + self.xh
+        zeta_ = v[:,1] / a + self.cy + self.yh
+        
+        if correction:
+            eta_, zeta_ = self.eta_zeta_from_bRinv(eta_, zeta_)
+        
+        return column_stack([eta_, zeta_])
     
     
     def eta_zeta_from_bRinv(self, eta_, zeta_):
@@ -247,24 +639,27 @@ class camera(object):
         This function returns (eta, zeta) for an input of b*[R]^-1. 
         To make inverting the non-linear correction solvable we 
         linearize the error term with a Taylor series expantion.
+        
+        eta_ and zeta_ can be either floats or arrays of equal shape.
         '''
         
-        Z3 = [eta_, zeta_, eta_**2, zeta_**2, eta_ * zeta_]
+        # Z3 = [eta_, zeta_, eta_**2, zeta_**2, eta_ * zeta_]
         #Z3 = [eta_, zeta_, eta_**2, zeta_**2, eta_ * zeta_,
         #      eta_**3, eta_**2*zeta_, eta_*zeta_**2, zeta_**3]
-        e_ = dot(self.E, Z3)
+        E0, E1 = self.E[:2].tolist()
+        e2, z2, ez = eta_**2, zeta_**2, eta_ * zeta_
         
         # calculating the derivatives of the error term:
-        e_0 = e_[0]
-        a, b, c, d, ee = self.E[0,:]
+        e_0 = E0[0]*eta_ + E0[1]*zeta_ + E0[2]*e2 + E0[3]*z2 + E0[4]*ez
+        a, b, c, d, ee = E0
         e_eta_0 = a + 2*c*eta_ + ee*zeta_
         e_zeta_0 = b + 2*d*zeta_ + ee*eta_
         #a, b, c, d, ee, f, g, h, i = self.E[0,:]
         #e_eta_0 = a + 2*c*eta_ + ee*zeta_ + 3*f*eta_**2 + 2*g*eta_*zeta_ + h*zeta_**2
         #e_zeta_0 = b + 2*d*zeta_ + ee*eta_ + g*eta_**2 + 2*h*eta_*zeta_ + 3*i*zeta_**2
         
-        e_1 = e_[1]
-        a, b, c, d, ee = self.E[1,:]
+        e_1 = E1[0]*eta_ + E1[1]*zeta_ + E1[2]*e2 + E1[3]*z2 + E1[4]*ez
+        a, b, c, d, ee = E1
         e_eta_1 = a + 2*c*eta_ + ee*zeta_
         e_zeta_1 = b + 2*d*zeta_ + ee*eta_
         #a, b, c, d, ee, f, g, h, i = self.E[1,:]
@@ -279,8 +674,11 @@ class camera(object):
         rhs1 = eta_*(1.0 + e_eta_0) + zeta_*e_zeta_0 - e_0
         rhs2 = zeta_*(1.0 + e_zeta_1) + eta_*e_eta_1 - e_1
         
-        Ainv = array([[A22, -A12],[-A21, A11]]) / (A11*A22 - A12*A21)
-        eta, zeta = dot(Ainv, [rhs1, rhs2])
+        # the inverse of the 2X2 matrix A, applied to the rhs; written out 
+        # so that this works both for scalars and for arrays of points
+        det = A11*A22 - A12*A21
+        eta = (A22*rhs1 - A12*rhs2) / det
+        zeta = (A11*rhs2 - A21*rhs1) / det
         
         return eta, zeta
     
@@ -292,33 +690,19 @@ class camera(object):
         '''
         full_path = os.path.join(dir_path, self.name)
         
-        f = open(full_path, 'w')
-        f.write(self.name+'\n')
-        
-        S = ''
-        for s in self.O:
-            S+= str(s)+' '
-        f.write(S+'\n')
-        
-        S = ''
-        for s in self.theta:
-            S+= str(s)+' '
-        f.write(S+'\n')
-        
-        f.write(str(self.f)+'\n')
-        
-        S = ''
-        for s in [self.xh, self.yh]:
-            S+= str(s)+' '
-        f.write(S+'\n')
+        # str gives the shortest representation that reads back to the 
+        # exact same float, so the text file round-trips without loss
+        def row(values):
+            return ' '.join([str(s) for s in values]) + ' \n'
         
-        for i in range(3):
-            S = ''
-            for s in self.E[i,:]:
-                S+= str(s)+' '
-            f.write(S+'\n')
-        
-        f.close()
+        with open(full_path, 'w') as f:
+            f.write(self.name+'\n')
+            f.write(row(self.O))
+            f.write(row(self.theta))
+            f.write(str(self.f)+'\n')
+            f.write(row([self.xh, self.yh]))
+            for i in range(3):
+                f.write(row(self.E[i,:]))
         
         
         
@@ -328,25 +712,16 @@ class camera(object):
         '''
         full_path = os.path.join(dir_path, self.name)
         
-        f = open(full_path, 'r')
-        name = f.readline()
-        
-        S = f.readline()[:-2]
-        self.O = array([float(s) for s in S.split()])
-        
-        S = f.readline()[:-2]
-        self.theta = array([float(s) for s in S.split()])
-        
-        self.f = float(f.readline()[:-2])
-        
-        S = f.readline()[:-2]
-        self.xh, self.yh = array([float(s) for s in S.split()])
+        # split() takes care of the trailing white spaces and line endings
+        with open(full_path, 'r') as f:
+            lines = [ln.split() for ln in f.readlines()]
         
+        self.O = array([float(s) for s in lines[1]])
+        self.theta = array([float(s) for s in lines[2]])
+        self.f = float(lines[3][0])
+        self.xh, self.yh = [float(s) for s in lines[4]]
         for i in range(3):
-            S = f.readline()[:-2]
-            self.E[i,:] = array([float(s) for s in S.split()])
-        
-        f.close()
+            self.E[i,:] = array([float(s) for s in lines[5+i]])
         
         self.calc_R()
         
@@ -359,32 +734,28 @@ class camera(object):
         
         z0, z1 = zlims
         r = self.get_r(eta, zeta)
-        a0 = (z0 - self.O[2])/r[2]
-        a1 = (z1 - self.O[2])/r[2]
-        x0, x1 = self.O[0]+a0*r[0], self.O[0]+a1*r[0]
-        y0, y1 = self.O[1]+a0*r[1], self.O[1]+a1*r[1]
         
+        # the two end points of the line, as rows of a 2X3 array
+        a = (array([z0, z1]) - self.O[2]) / r[2]
+        pts = self.O + a[:,None]*r
+        
+        if color is None:
+            kwargs, fmt = {}, 'ko'
+        else:
+            kwargs, fmt = {'c': color}, 'o'
+        
+        fig = None
         if ax is None:
             from mpl_toolkits import mplot3d
             import matplotlib.pyplot as plt
             fig = plt.figure()
             ax = plt.axes(projection='3d')
-            if color is None:
-                ax.plot3D([x0,x1], [z0,z1], [y0,y1])
-                ax.plot3D([self.O[0]], [self.O[2]], [self.O[1]], 'ko')
-            else:
-                ax.plot3D([x0,x1], [z0,z1], [y0,y1], c=color)
-                ax.plot3D([self.O[0]], [self.O[2]], [self.O[1]], 'o', c=color)
         
+        ax.plot3D(pts[:,0], [z0,z1], pts[:,1], **kwargs)
+        ax.plot3D([self.O[0]], [self.O[2]], [self.O[1]], fmt, **kwargs)
+        
+        if fig is not None:
             return fig, ax
-       
-        else:
-            if color is None:
-                ax.plot3D([x0,x1], [z0,z1], [y0,y1])
-                ax.plot3D([self.O[0]], [self.O[2]], [self.O[1]], 'ko')
-            else:
-                ax.plot3D([x0,x1], [z0,z1], [y0,y1], c=color)
-                ax.plot3D([self.O[0]], [self.O[2]], [self.O[1]], 'o', c=color)
             
     
 
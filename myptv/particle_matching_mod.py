@@ -25,7 +25,7 @@ algorithm.
 from myptv.utils import line_dist
 from math import ceil, floor
 from itertools import combinations, product
-from numpy import loadtxt, savetxt, array
+from numpy import loadtxt, savetxt, array, empty
 from scipy.spatial import KDTree
 
 from pandas import read_csv
@@ -336,10 +336,11 @@ class matching(object):
             particles_i = particles_dic[cam.name]
             self.ray_camera_indexes.append(len(particles_i) + 
                                            self.ray_camera_indexes[-1])
+            xs = [p[0] for p in particles_i]
+            ys = [p[1] for p in particles_i]
+            r_i = cam.get_r_batch(xs, ys)
             for j in range(len(particles_i)):
-                x, y = particles_i[j][0], particles_i[j][1]
-                r_ij = cam.get_r(x, y)
-                self.rays.append( (x, y, (i,j), r_ij) )
+                self.rays.append( (xs[j], ys[j], (i,j), r_i[j]) )
         
         self.RIO = RIO
         self.voxel_size = voxel_size
@@ -378,9 +379,9 @@ class matching(object):
         if [ray[0], ray[1]] == [-1,-1]:
             return
         
-        cam  = self.imsys.cameras[ray[2][0]]
-        O = cam.O
-        r = cam.get_r(ray[0], ray[1])
+        # the ray direction was already calculated in __init__
+        O = self.imsys.cameras[ray[2][0]].O
+        r = ray[3]
         r_ = r / sum(r**2)**0.5
 
         a1, a2 = (self.RIO[2][0] - O[2])/r_[2], (self.RIO[2][1] - O[2])/r_[2]
@@ -481,30 +482,29 @@ class matching(object):
         cams = []
         for ray in rays:
             i = self.ray_camera_indexes[ray[0]] 
-            ip1 = self.ray_camera_indexes[ray[0]+1]
-            ri = self.rays[i:ip1][ray[1]][3]
-            Oi = self.imsys.cameras[self.rays[i:ip1][ray[1]][2][0]].O
+            ri = self.rays[i + ray[1]][3]
+            Oi = self.imsys.cameras[ray[0]].O
             dc[ray[0]] = Oi, ri
             cams.append(ray[0])
         
         n = len(rays)
-        d, x = [], []
+        d, x = empty(n*(n-1)//2), empty((n*(n-1)//2, 3))
         
+        p = 0
         for i in range(n):
             Oi, ri = dc[cams[i]]
             for j in range(i+1, n):
                 Oj, rj = dc[cams[j]]
                 D, x_ij = line_dist(Oi, ri, Oj, rj)
-                #d.append(D)
-                #x.append(x_ij)
                 
                 if D<4*self.max_err:
-                    d.append(D)
-                    x.append(x_ij)
+                    d[p] = D
+                    x[p,:] = x_ij
+                    p += 1
                 else:
                     return x_ij, cams, 1e9
         
-        return sum(x)/1.0/len(x), cams, sum(d)/1.0/len(x)
+        return x.mean(axis=0), cams, d.mean()
 
     
     
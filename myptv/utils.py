@@ -11,9 +11,9 @@ Utility code to use for the MyPTV package.
 
 
 
-from numpy import dot, array, loadtxt, savetxt
+from numpy import dot, array, loadtxt, savetxt, eye, einsum
 from numpy import append as NPappend
-from numpy.linalg import inv, norm
+from numpy.linalg import inv, norm, solve
 
 
 
@@ -83,6 +83,32 @@ def point_line_dist(O,r,P):
 
 
 
+def nearest_point_to_lines(O, r):
+    '''
+    For N lines (O[i] + a r[i]), this returns the point that minimizes the 
+    sum of squared distances to the lines. With the projectors on the 
+    planes normal to the lines, P_i = I - r_i r_i^T (for unit r_i), the 
+    point is the solution of the 3X3 linear system:
+        
+        sum_i(P_i) x = sum_i(P_i O_i)
+    
+    input - 
+    O, r (arrays, N X 3) - the origins and directions of the lines; must
+                           have at least 2 lines that are not parallel
+    
+    output - 
+    x (array, 3) - the point nearest to the lines
+    dist (array, N) - the distance of x from each of the lines
+    '''
+    r = r / norm(r, axis=1)[:,None]
+    P = eye(3) - einsum('ni,nj->nij', r, r)
+    PO = einsum('nij,nj->ni', P, O)
+    x = solve(P.sum(axis=0), PO.sum(axis=0))
+    dist = norm(einsum('nij,j->ni', P, x) - PO, axis=1)
+    return x, dist
+
+
+
 def fit_polynomial(x, y, n):
     '''
     A polynomial of degree n is written as:
@@ -248,17 +274,12 @@ def find_point_nearest_to_lines(line_list):
 
 
 def nearest_intersect(lines):
-    import numpy as np
-    I = np.eye(3)
-    
-    S1 = 0
-    S2 = 0
-    for i in range(len(lines)):
-        Oi = np.array([lines[i][0]])
-        ri = lines[i][1]
-        S1 += I - np.dot(Oi.T, Oi)
-        S2 += np.dot(I - np.dot(Oi.T, Oi), ri)
-    return np.linalg.lstsq(S1, S2, rcond=None)
+    '''
+    Same as nearest_point_to_lines() for a list of tuples (O, r).
+    '''
+    O = array([l[0] for l in lines])
+    r = array([l[1] for l in lines])
+    return nearest_point_to_lines(O, r)[0]
         
 #=============================================================================
 
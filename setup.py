@@ -12,6 +12,7 @@ setup(
     version='0.5.1',
     description='A 3D Particle Tracking Velocimetry library',
     install_requires=['numpy', 'scipy', 'scikit-image','pandas','matplotlib','pyyaml', 'tk', 'Pillow'],
+    extras_require={'fast': ['numba']},
     author='Ron Shnapp',
     author_email='ronshnapp@gmail.com',
     license='MIT',
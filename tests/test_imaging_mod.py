@@ -8,9 +8,11 @@ A test function for the imaging module
 
 """
 
+import pytest
 from myptv import imaging_mod 
-from numpy import array
-from math import pi
+from numpy import array, float32, float64, dot, eye
+from numpy.random import default_rng
+from math import pi, sin, cos
 
 
 def test_imaging():
@@ -60,3 +62,295 @@ def test_imaging():
     a, b, c = round(res[0][0], 10), round(res[0][1], 10), round(res[0][2], 10)
     assert a == 0.1 and b == 0.1, c == 0.1
 
+
+
+def test_project_all():
+    '''
+    Checks that projecting a point on all the cameras of the imaging
+    system at once gives the same result as projecting it on each camera.
+    '''
+    c1 = imaging_mod.camera('1', (1000.,1000.))
+    c2 = imaging_mod.camera('2', (1000.,1000.))
+    
+    c1.O = array([400.0 , 0, 1])
+    c2.O = array([0, 400.0, -1])
+    c1.f = 4000
+    c2.f = 4000
+    c1.theta = array([0.0, -1*pi / 2.0, 0.0])
+    c2.theta = array([pi / 2.0, 0., 0.])
+    c1.calc_R()
+    c2.calc_R()
+    c1.xh = 1.0
+    c1.E[0,:] = [1e-3, -2e-3, 1e-6, 2e-6, -1e-6]
+    
+    imgsys = imaging_mod.img_system([c1,c2])
+    x = array([0.1,0.2,0.3])
+    proj = imgsys.project_all(x)
+    assert abs(proj[0] - c1.projection(x)).max() < 1e-8
+    assert abs(proj[1] - c2.projection(x)).max() < 1e-8
+    
+    # the stacks must follow changes in the cameras' calibration, also 
+    # when O or f are changed without calling calc_R
+    c2.O = array([0, 300.0, -1])
+    proj = imgsys.project_all(x)
+    assert abs(proj[1] - c2.projection(x)).max() < 1e-8
+    
+    c1.O[0] += 5.0
+    c1.f = 3000
+    proj = imgsys.project_all(x)
+    assert abs(proj[0] - c1.projection(x)).max() < 1e-8
+
+
+def test_save_load(tmp_path):
+    '''
+    Checks that a camera saved to a file is loaded back with exactly the
+    same parameters.
+    '''
+    c1 = imaging_mod.camera('cam1', (1000.,1000.))
+    c1.O = array([400.123456789 , 0, 1])
+    c1.theta = array([0.1, -1*pi / 2.0, 0.3])
+    c1.f = 4000.12345
+    c1.xh = 1.0
+    c1.yh = -1.0
+    c1.E[0,:] = [1e-3, -2e-3, 1e-6, 2e-6, -1e-6]
+    c1.calc_R()
+    c1.save(str(tmp_path))
+    
+    c2 = imaging_mod.camera('cam1', (1000.,1000.))
+    c2.load(str(tmp_path))
+    assert (c2.O == c1.O).all() and (c2.theta == c1.theta).all()
+    assert c2.f == c1.f and c2.xh == c1.xh and c2.yh == c1.yh
+    assert (c2.E == c1.E).all() and (c2.R == c1.R).all()
+
+
+def test_get_r_batch():
+    '''
+    Checks that the batched ray directions are the same as those of get_r.
+    '''
+    c1 = imaging_mod.camera('1', (1000.,1000.))
+    c1.O = array([400.0 , 0, 1])
+    c1.f = 4000
+    c1.theta = array([0.8, -0.4, 0.1])
+    c1.calc_R()
+    c1.xh = 1.0
+    c1.yh = -1.0
+    c1.E[0,:] = [1e-3, -2e-3, 1e-6, 2e-6, -1e-6]
+    c1.E[1,:] = [2e-4, 1e-4, -1e-6, 1e-7, 3e-7]
+    
+    etas, zetas = [10.0, 500.0, 990.0], [20.0, 600.0, 300.0]
+    r = c1.get_r_batch(etas, zetas)
+    for i in range(3):
+        assert abs(r[i] - c1.get_r(etas[i], zetas[i])).max() < 1e-12
+
+
+def test_projection_batch():
+    '''
+    Checks that the batched projections are the same as those of 
+    projection, with and without the non-linear correction.
+    '''
+    c1 = imaging_mod.camera('1', (1000.,1000.))
+    c1.O = array([200.0, 400.0 ,400])
+    c1.f = 4000
+    c1.theta = array([0.8, -0.4, 0.0])
+    c1.calc_R()
+    c1.xh = 1.0
+    c1.yh = -1.0
+    c1.E[0,:] = [1e-3, -2e-3, 1e-6, 2e-6, -1e-6]
+    c1.E[1,:] = [2e-4, 1e-4, -1e-6, 1e-7, 3e-7]
+    
+    X = array([[0.1, 0.1, 0.1], [5.0, -3.0, 2.0], [-10.0, 4.0, 0.0]])
+    for correction in [True, False]:
+        proj = c1.projection_batch(X, correction=correction)
+        for i in range(3):
+            p = c1.projection(X[i], correction=correction)
+            assert abs(proj[i] - p).max() < 1e-8
+
+
+def test_stereo_match_float32():
+    '''
+    Checks that batch stereo matching in single precision is stable for 
+    two nearly parallel epipolar lines (a short baseline far from the 
+    point).
+    '''
+    c1 = imaging_mod.camera('1', (1000.,1000.))
+    c2 = imaging_mod.camera('2', (1000.,1000.))
+    c1.O = array([0.0, 0.0, 500.0])
+    c2.O = array([1.0, 0.0, 500.0])
+    for c in [c1, c2]:
+        c.f = 4000
+        c.theta = array([0.0, 0.0, 0.0])
+        c.calc_R()
+    
+    x = array([0.3, 0.2, 0.1])
+    coords = array([[c1.projection(x), c2.projection(x)]])
+    
+    imgsys = imaging_mod.img_system([c1,c2], dtype=float32)
+    res = imgsys.stereo_match_batch(coords, 1e9)
+    assert res[0].dtype == float64
+    assert abs(res[0][0] - x).max() < 1e-3
+
+
+@pytest.mark.parametrize('use_numexpr', [True, False])
+def test_stereo_match_batch(use_numexpr, monkeypatch):
+    '''
+    Checks that the batched stereo matching gives the same results as
+    stereo_match for each particle, both with numexpr (if it is 
+    installed) and with plain numpy.
+    '''
+    if use_numexpr:
+        # numexpr is used only with several threads
+        numexpr = pytest.importorskip('numexpr')
+        monkeypatch.setattr(numexpr, 'get_num_threads', lambda: 2)
+    else:
+        monkeypatch.setattr(imaging_mod, 'numexpr', None)
+    
+    c1 = imaging_mod.camera('1', (1000.,1000.))
+    c2 = imaging_mod.camera('2', (1000.,1000.))
+    c3 = imaging_mod.camera('3', (1000.,1000.))
+    c1.O = array([400.0 , 0, 1])
+    c2.O = array([0, 400.0, -1])
+    c3.O = array([200.0, 400.0 ,400])
+    c1.theta = array([0.0, -1*pi / 2.0, 0.0])
+    c2.theta = array([pi / 2.0, 0., 0.])
+    c3.theta = array([0.8, -0.4, 0.0])
+    for c in [c1, c2, c3]:
+        c.f = 4000
+        c.calc_R()
+    imgsys = imaging_mod.img_system([c1,c2,c3])
+    
+    X = array([[0.1, 0.1, 0.1], [5.0, -3.0, 2.0], [-10.0, 4.0, 0.0]])
+    coords = array([[c.projection(x) for c in [c1,c2,c3]] for x in X])
+    coords[1,0] += 50.0        # a bad image of the second particle
+    coords[2,2] = float('nan') # a missing image of the third particle
+    
+    x, dist, cams_mask = imgsys.stereo_match_batch(coords, 0.1)
+    for i in range(3):
+        dic = dict([(k, coords[i,k]) for k in range(3) 
+                    if coords[i,k,0] == coords[i,k,0]])
+        res = imgsys.stereo_match(dic, 0.1)
+        assert abs(x[i] - res[0]).max() < 1e-8
+        assert abs(dist[i] - res[2]) < 1e-8
+        assert set([k for k in range(3) if cams_mask[i] >> k & 1]) == res[1]
+    
+    # a camera added after the imaging system was made
+    c4 = imaging_mod.camera('4', (1000.,1000.))
+    c4.O = array([-300.0, 100.0, 50.0])
+    c4.theta = array([0.1, pi / 2.0, 0.2])
+    c4.f = 4000
+    c4.calc_R()
+    imgsys.cameras.append(c4)
+    coords = array([[c.projection(x) for c in [c1,c2,c3,c4]] for x in X])
+    x, dist, cams_mask = imgsys.stereo_match_batch(coords, 0.1)
+    assert abs(x - X).max() < 1e-8 and (cams_mask == 15).all()
+
+
+def test_triangulate():
+    '''
+    Checks that the nearest point to all the epipolar lines gives back a 
+    synthetic point, and that a camera with a bad image is rejected.
+    '''
+    c1 = imaging_mod.camera('1', (1000.,1000.))
+    c2 = imaging_mod.camera('2', (1000.,1000.))
+    c3 = imaging_mod.camera('3', (1000.,1000.))
+    c1.O = array([400.0 , 0, 1])
+    c2.O = array([0, 400.0, -1])
+    c3.O = array([200.0, 400.0 ,400])
+    c1.theta = array([0.0, -1*pi / 2.0, 0.0])
+    c2.theta = array([pi / 2.0, 0., 0.])
+    c3.theta = array([0.8, -0.4, 0.0])
+    for c in [c1, c2, c3]:
+        c.f = 4000
+        c.calc_R()
+    imgsys = imaging_mod.img_system([c1,c2,c3])
+    
+    x = array([0.1, 0.2, 0.3])
+    coords = {0: c1.projection(x), 1: c2.projection(x), 2: c3.projection(x)}
+    res = imgsys.triangulate(coords, 1e9)
+    assert abs(res[0] - x).max() < 1e-8
+    assert abs(res[0] - imgsys.stereo_match(coords, 1e9)[0]).max() < 1e-8
+    
+    coords[0] = coords[0] + 50.0
+    res = imgsys.triangulate(coords, 0.5)
+    assert res[1] == set([1, 2]) and abs(res[0] - x).max() < 1e-8
+
+
+def test_stereo_match_camera_moved():
+    '''
+    Checks that stereo_match uses the current camera positions when O is 
+    changed in place without calling calc_R.
+    '''
+    c1 = imaging_mod.camera('1', (1000.,1000.))
+    c2 = imaging_mod.camera('2', (1000.,1000.))
+    c3 = imaging_mod.camera('3', (1000.,1000.))
+    c1.O = array([400.0 , 0, 1])
+    c2.O = array([0, 400.0, -1])
+    c3.O = array([200.0, 400.0 ,400])
+    c1.theta = array([0.0, -1*pi / 2.0, 0.0])
+    c2.theta = array([pi / 2.0, 0., 0.])
+    c3.theta = array([0.8, -0.4, 0.0])
+    for c in [c1, c2, c3]:
+        c.f = 4000
+        c.calc_R()
+    imgsys = imaging_mod.img_system([c1,c2,c3])
+    
+    x = array([0.1, 0.2, 0.3])
+    coords = {0: c1.projection(x), 1: c2.projection(x), 2: c3.projection(x)}
+    imgsys.stereo_match(coords, 1e9)
+    
+    # moving all the cameras together moves the matched point with them
+    for c in [c1, c2, c3]:
+        c.O += array([5.0, 0.0, 0.0])
+    res = imgsys.stereo_match(coords, 1e9)
+    assert abs(res[0] - (x + array([5.0, 0.0, 0.0]))).max() < 1e-8
+    res = imgsys.triangulate(coords, 1e9)
+    assert abs(res[0] - (x + array([5.0, 0.0, 0.0]))).max() < 1e-8
+
+
+def test_stereo_match_kernel():
+    '''
+    Checks the pair computations of stereo matching for four lines with 
+    one pair that is too far apart and one pair of parallel lines.
+    '''
+    O = array([[-10.0, 0, 0], [0, -10.0, 0], [0, 0, -10.0], [-10.0, 0, 0.05]])
+    r = array([[1.0, 0, 0], [0, 1.0, 0], [0, 0, 1.0], [1.0, 0, 0]])
+    
+    # when numba is installed we test both the compiled kernel and the 
+    # python function under the jit
+    kernel = imaging_mod.stereo_match_kernel
+    funcs = [kernel, getattr(kernel, 'py_func', kernel)]
+    
+    # lines 0 and 3 are parallel, and lines 1 and 3 are 0.05 apart
+    for func in funcs:
+        x, dist, cams_mask = func(O, r, 0.01)
+        assert abs(x - array([0, 0, 0.0125])).max() < 1e-12
+        assert abs(dist) < 1e-12
+        assert cams_mask == 15
+    
+    # with only the parallel lines 0 and 3 no pair is accepted
+    for func in funcs:
+        assert func(O[[0,3]], r[[0,3]], 0.01)[2] == 0
+
+
+def test_calc_R():
+    '''
+    Checks the rotation matrix against the product of the rotations 
+    about the x, y and z axes, for random angles.
+    '''
+    rng = default_rng(0)
+    c1 = imaging_mod.camera('1', (1000.,1000.))
+    for i in range(10):
+        tx, ty, tz = rng.uniform(-pi, pi, 3)
+        c1.theta = array([tx, ty, tz])
+        c1.calc_R()
+        
+        Rx = array([[1,0,0],
+                    [0,cos(tx),-sin(tx)],
+                    [0,sin(tx),cos(tx)]])
+        Ry = array([[cos(ty),0,sin(ty)],
+                    [0,1,0],
+                    [-sin(ty),0,cos(ty)]])
+        Rz = array([[cos(tz),-sin(tz),0],
+                    [sin(tz),cos(tz),0],
+                    [0,0,1]])
+        assert abs(c1.R - dot(dot(Rx,Ry), Rz)).max() < 1e-14
+        assert abs(dot(c1.R, c1.R_T) - eye(3)).max() < 1e-14